@@ -0,0 +1,6 @@
+__author__ = "Thorin Schiffer"
+
+import django
+
+if django.VERSION < (3, 2):  # pragma: no cover
+    default_app_config = "django_plpy.apps.DjangoPlpyConfig"
@@ -0,0 +1,20 @@
+from django.apps import AppConfig
+from django.db.models.signals import post_migrate
+
+
+class DjangoPlpyConfig(AppConfig):
+    """
+    Django-plpy application config
+    """
+
+    name = "django_plpy"
+
+    def ready(self):
+        """
+        Connects the signal handlers of the application
+        """
+        from django_plpy.installer import forget_installed_functions
+
+        post_migrate.connect(
+            forget_installed_functions, dispatch_uid="django_plpy_forget_installed"
+        )
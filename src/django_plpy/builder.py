@@ -1,10 +1,9 @@
 import inspect
+from functools import lru_cache
 from textwrap import dedent
 from typing import Dict, List
 import json
-from django_plpy.settings import ENV_PATHS, PROJECT_PATH
 from django_plpy.utils import remove_decorator
-from django.conf import settings
 
 type_mapper = {
     int: "integer",
@@ -16,52 +15,224 @@ type_mapper = {
     bool: "boolean",
     float: "real",
 }
+# generics missing in type_mapper are looked up by their origin and arguments, so list[str] (PEP 585)
+# maps to the same type as typing.List[str]
+_generic_types = {
+    (dict, (str, str)): "JSONB",
+    (list, (str,)): "varchar[]",
+    (list, (int,)): "int[]",
+}
+# python 3.6 reports the typing classes as the origin
+_origins = {Dict: dict, List: list}
+
+# templates of the generated code, rendered with str.format_map
+# the function is defined from its compiled source once per session and kept in SD,
+# the following calls only look it up
+_definition_imports = """from typing import Dict, List
+import json
+"""
+_function_template = """{header}
+AS $$
+{call_imports}if "{name}" not in SD:
+    namespace = dict(globals())
+    exec(compile({source!r}, "{name}", "exec"), namespace)
+{define_statement}{global_statement}{name} = SD["{name}"]
+return {name}({python_args})
+$$ LANGUAGE plpython3u;
+"""
+_define_statement = """    SD["{name}"] = namespace["{name}"]
+"""
+_jit_define_statement = """    try:
+        from numba import njit
+        SD["{name}"] = njit(namespace["{name}"])
+    except ImportError:
+        SD["{name}"] = namespace["{name}"]
+"""
+_global_statement = """    GD["{name}"] = SD["{name}"]
+"""
+# the values are passed as bound parameters of a plan prepared once per session
+_orm_import_template = """
+if "pl_enable_orm" not in SD:
+    SD["pl_enable_orm"] = plpy.prepare(
+        "select pl_enable_orm($1, $2, $3, $4)", ["varchar[]", "varchar", "varchar", "jsonb"]
+    )
+plpy.execute(
+    SD["pl_enable_orm"],
+    [{env_paths!r}, {project_path!r}, {settings_module!r}, {extra_env!r}],
+)
+from django.apps import apps
+from django.forms.models import model_to_dict
+
+{model_name} = apps.get_model('{app_name}', '{model_name}')
+new = {model_name}(**TD['new'])
+old = {model_name}(**TD['old']) if TD['old'] else None
+"""
+_orm_back_convert_statement = """
+TD['new'].update(model_to_dict(new))
+if TD['old']:
+    TD['old'].update(model_to_dict(old))
+"""
+_trigger_template = """{header}
+AS $$
+{import_statement}
+{body}
+{call_statement}
+{back_convert_statement}
+return 'MODIFY'
+$$ LANGUAGE plpython3u;
+
+DROP TRIGGER IF EXISTS {trigger_name} ON {table} CASCADE;
+CREATE TRIGGER {trigger_name}
+{when} {event} ON {table}
+FOR EACH ROW
+EXECUTE PROCEDURE {name}();
+"""
+
+
+def _map_type(annotation):
+    """
+    Maps the python type annotation to the Postgres type
+    @param annotation: python type annotation
+    @return: name of the Postgres type or None if the annotation is not supported
+    """
+    # type_mapper comes first, so the types mapped or overridden by the project take precedence
+    pl_type = type_mapper.get(annotation)
+    origin = getattr(annotation, "__origin__", None)
+    if pl_type is None and origin is not None:
+        pl_type = _generic_types.get(
+            (_origins.get(origin, origin), getattr(annotation, "__args__", None))
+        )
+    return pl_type
 
 
-def build_pl_function(f, global_=False) -> str:
+# prepared bodies of the functions, keyed by their code object and the removed decorator, so function objects
+# created by the same def statement, like nested functions, share them, while a reloaded module gets new ones
+_bodies = {}
+
+
+def function_body(f, decorator_name):
+    """
+    Returns the source code of the function without the decorator, ready to be copied to the stored procedure.
+    Reading, tokenizing and dedenting the source is the most expensive part of the build, it's done once per
+    function. Decorated functions carry the body prepared at decoration time
+    @param f: function / callable
+    @param decorator_name: name of the decorator to remove
+    @return: dedented source code of the function
+    """
+    body = getattr(f, "_plpy_body", None)
+    if body is None:
+        key = (inspect.unwrap(f).__code__, decorator_name)
+        body = _bodies.get(key)
+        if body is None:
+            source = inspect.getsource(f)
+            body = _bodies[key] = dedent(remove_decorator(source, decorator_name))
+    return body
+
+
+@lru_cache(maxsize=None)
+def _function_spec(f):
+    """
+    Translates the signature of the function to the stored procedure arguments once per function, the result
+    is shared by all the variants of the stored procedure built from it
+    @param f: function / callable
+    @return: tuple of the stored procedure arguments, the python call arguments, the return type, the imports
+    the call of the function needs and the argument types
+    """
+    # only names and annotations are needed, reading them from the code object is much cheaper
+    # than constructing inspect.signature
+    unwrapped = inspect.unwrap(f)
+    code = unwrapped.__code__
+    annotations = unwrapped.__annotations__
+    arg_names = code.co_varnames[: code.co_argcount + code.co_kwonlyargcount]
+    # local names are faster than globals and attributes in the loop
+    empty = inspect._empty
+    get_annotation = annotations.get
+    map_type = _map_type
+    pl_args = []
+    pl_types = []
+    python_args = []
+    for arg in arg_names:
+        annotation = get_annotation(arg, empty)
+        if annotation is empty:
+            raise RuntimeError(
+                f"Function {f} must be fully annotated to be translated to pl/python"
+            )
+        pl_type = map_type(annotation)
+        if pl_type is None:
+            raise RuntimeError(f"Unknown type {annotation}")
+        pl_args.append(f"{arg} {pl_type}")
+        pl_types.append(pl_type)
+        # compare the mapped type, not the annotation: typing generics compare structurally
+        python_args.append(f"json.loads({arg})" if pl_type == "JSONB" else arg)
+
+    return_annotation = get_annotation("return", empty)
+    return_type = map_type(return_annotation)
+    if return_type is None:
+        raise RuntimeError(f"Unknown type {return_annotation}")
+    # the call is run every time, it only imports json to decode JSONB arguments
+    call_imports = "import json\n" if "JSONB" in pl_types else ""
+    return (
+        ",".join(pl_args),
+        ",".join(python_args),
+        return_type,
+        call_imports,
+        ",".join(pl_types),
+    )
+
+
+@lru_cache(maxsize=None)
+def build_pl_function(f, global_=False, jit=False) -> str:
     """
     Builds the source code of the plpy stored procedure from the local python code.
     The function code gets copied and installed to the database.
     Use syncfunctions manage.py command to install the functions to the database
     @param f: function / callable the code of will be rendered to the plpy stored procedure
+    @param global_: make the function available to other plpy functions over GD dict
+    @param jit: compile the function with numba's njit in the database interpreter, falls back to the plain
+    function if numba is not installed there
     @return: the code of the stored procedure
     """
     name = f.__name__
-    signature = inspect.signature(f)
-    pl_args = []
-    python_args = []
-    for arg, specs in signature.parameters.items():
-        if specs.annotation is inspect._empty:
-            raise RuntimeError(
-                f"Function {f} must be fully annotated to be translated to pl/python"
-            )
-        if specs.annotation not in type_mapper:
-            raise RuntimeError(f"Unknown type {specs.annotation}")
-        pl_args.append(f"{arg} {type_mapper[specs.annotation]}")
-        if specs.annotation == Dict[str, str]:
-            python_args.append(f"json.loads({arg})")
-        else:
-            python_args.append(arg)
-
-    header = (
-        f"CREATE OR REPLACE FUNCTION {name} ({','.join(pl_args)}) "
-        f"RETURNS {type_mapper[signature.return_annotation]}"
+    pl_args, python_args, return_type, call_imports, _ = _function_spec(f)
+    names = {"name": name}
+    return _function_template.format_map(
+        {
+            "header": f"CREATE OR REPLACE FUNCTION {name} ({pl_args}) RETURNS {return_type}",
+            "call_imports": call_imports,
+            "name": name,
+            # the imports are run once with the definition and stay available to the body
+            "source": _definition_imports + function_body(f, "plfunction"),
+            "define_statement": (
+                _jit_define_statement if jit else _define_statement
+            ).format_map(names),
+            "global_statement": _global_statement.format_map(names) if global_ else "",
+            "python_args": python_args,
+        }
     )
 
-    body = remove_decorator(inspect.getsource(f), "plfunction")
-    return f"""{header}
-AS $$
-from typing import Dict, List
-import json
-{dedent(body)}
-return {name}({','.join(python_args)})
-{"GD['{name}'] = {name}" if global_ else ""}
-$$ LANGUAGE plpython3u
-"""
+
+def function_signature(f):
+    """
+    Returns the signature of the stored procedure built from the function, it tells apart the overloads
+    with the same name
+    @param f: function / callable
+    @return: name and argument types of the stored procedure, e.g. pl_max(integer,integer)
+    """
+    return f"{f.__name__}({_function_spec(f)[4]})"
+
+
+def resolve_model(model):
+    """
+    Resolves the names a trigger needs from the django model
+    @param model: django model
+    @return: tuple of the table name, model name and app label
+    """
+    meta = model._meta
+    return meta.db_table, meta.object_name, meta.app_label
 
 
 def build_pl_trigger_function(
-    f, event, when, table=None, model=None, extra_env=None
+    f, event, when, table=None, model=None, extra_env=None, model_meta=None
 ) -> str:
     """
     Builds source code of the trigger function from the python function f.
@@ -75,58 +246,60 @@ def build_pl_trigger_function(
     @param model: django model name the trigger is to be associated with, incompatible with tabel argument
     @param extra_env: extra environment to be passed to the pl_enable_orm function, will be dumped plaintext in the
     text of the function!
+    @param model_meta: model names as returned by resolve_model, alternative to model resolved in advance
     @return: source code of the trigger function
     """
-    extra_env = extra_env or {}
-    if not table and not model:
+    if model:
+        model_meta = resolve_model(model)
+    if not table and not model_meta:
         raise RuntimeError("Either model or table must be set for trigger installation")
+    # extra_env is a dict and can't be a part of the cache key as is
+    return _build_pl_trigger_function(
+        f, event, when, table, model_meta, json.dumps(extra_env or {}, sort_keys=True)
+    )
+
 
+@lru_cache(maxsize=None)
+def _build_pl_trigger_function(f, event, when, table, model_meta, extra_env) -> str:
+    """
+    Cached implementation of build_pl_trigger_function
+    @param model_meta: model names as returned by resolve_model
+    @param extra_env: extra environment dumped to json
+    """
     name = f.__name__
-    if model:
-        meta = model.objects.model._meta
-        table = meta.db_table
-        model_name = meta.object_name
-        app_name = meta.app_label
-        import_statement = f"""
-extra_env = '{json.dumps(extra_env)}'
-plpy.execute(
-    "select pl_enable_orm(array{ENV_PATHS}, '{PROJECT_PATH}', '{settings.SETTINGS_MODULE}', '%s')" % extra_env
-)
-from django.apps import apps
-from django.forms.models import model_to_dict
+    if model_meta:
+        # reading the settings requires configured django, import them only when they are needed
+        from django.conf import settings
+        from django_plpy.settings import ENV_PATHS, PROJECT_PATH
 
-{model_name} = apps.get_model('{app_name}', '{model_name}')
-new = {model_name}(**TD['new'])
-old = {model_name}(**TD['old']) if TD['old'] else None
-"""
+        table, model_name, app_name = model_meta
+        import_statement = _orm_import_template.format_map(
+            {
+                "env_paths": [str(path) for path in ENV_PATHS],
+                "project_path": str(PROJECT_PATH),
+                "settings_module": settings.SETTINGS_MODULE,
+                "extra_env": extra_env,
+                "model_name": model_name,
+                "app_name": app_name,
+            }
+        )
         call_statement = f"{name}(new, old, TD, plpy)"
-        back_convert_statement = """
-TD['new'].update(model_to_dict(new))
-if TD['old']:
-    TD['old'].update(model_to_dict(old))
-"""
+        back_convert_statement = _orm_back_convert_statement
     else:
         import_statement = back_convert_statement = ""
         call_statement = f"{name}(TD, plpy)"
 
-    header = f"CREATE OR REPLACE FUNCTION {name}() RETURNS TRIGGER"
-
-    body = remove_decorator(inspect.getsource(f), "pltrigger")
-    return f"""
-BEGIN;
-{header}
-AS $$
-{import_statement}
-{dedent(body)}
-{call_statement}
-{back_convert_statement}
-return 'MODIFY'
-$$ LANGUAGE plpython3u;
-
-DROP TRIGGER IF EXISTS {name + '_trigger'} ON {table} CASCADE;
-CREATE TRIGGER {name + '_trigger'}
-{when} {event} ON {table}
-FOR EACH ROW
-EXECUTE PROCEDURE {name}();
-END;
-"""
+    return _trigger_template.format_map(
+        {
+            "header": f"CREATE OR REPLACE FUNCTION {name}() RETURNS TRIGGER",
+            "import_statement": import_statement,
+            "body": function_body(f, "pltrigger"),
+            "call_statement": call_statement,
+            "back_convert_statement": back_convert_statement,
+            "trigger_name": f"{name}_trigger",
+            "table": table,
+            "when": when,
+            "event": event,
+            "name": name,
+        }
+    )
@@ -1,14 +1,146 @@
 __author__ = "Thorin Schiffer"
 
-import inspect
-from functools import wraps
+import hashlib
+from functools import lru_cache
 from typing import Dict, List
 
-from django.db import connection
-from django_plpy.builder import build_pl_trigger_function, build_pl_function
+from django_plpy.builder import (
+    build_pl_trigger_function,
+    build_pl_function,
+    function_body,
+    function_signature,
+    resolve_model,
+)
 
 
-def install_function(f, trigger_params=None, function_params=None, cursor=None):
+# hashes of the functions installed by this process, keyed by database and function signature
+_installed_hashes = {}
+
+
+def forget_installed_functions(**kwargs):
+    """
+    Forgets the functions installed by this process, so they are installed again.
+    Connected to post_migrate, which is also sent when the database is flushed
+    """
+    _installed_hashes.clear()
+
+
+def render_function(f, trigger_params=None, function_params=None):
+    """
+    Renders the source code of the trigger or stored procedure for the function f without installing it
+    @param f: function/callable to render
+    @param trigger_params: dict with params as accepted by build_pl_trigger_function
+    @param function_params: dict with params as accepted by build_pl_function
+    @return: source code of the trigger or stored procedure
+    """
+    if trigger_params:
+        return build_pl_trigger_function(f, **trigger_params)
+    return build_pl_function(f, **(function_params or {}))
+
+
+@lru_cache(maxsize=None)
+def _digest(pl_python_function):
+    """
+    Hashes the source code of a stored procedure, the builders return the same cached strings on every call
+    @param pl_python_function: source code of the stored procedure
+    @return: sha256 digest of the source code
+    """
+    return hashlib.sha256(pl_python_function.encode()).digest()
+
+
+def _installed_object(f, trigger_params=None, function_params=None):
+    """
+    Renders the function and names the database objects it is installed as
+    @param f: function/callable to render
+    @param trigger_params: dict with params as accepted by build_pl_trigger_function
+    @param function_params: dict with params as accepted by build_pl_function
+    @return: tuple of the key of the function in the django_plpy_installed table and a tuple of its source code,
+    the signature of its stored procedure, its trigger and the table of the trigger
+    """
+    pl_python_function = render_function(f, trigger_params, function_params)
+    if not trigger_params:
+        signature = function_signature(f)
+        return signature, (pl_python_function, signature, None, None)
+
+    # the trigger function is replaced by the last one with its name, its triggers are kept on every table
+    model_meta = trigger_params.get("model_meta")
+    if not model_meta and trigger_params.get("model"):
+        model_meta = resolve_model(trigger_params["model"])
+    table = model_meta[0] if model_meta else trigger_params["table"]
+    trigger = f"{f.__name__}_trigger"
+    return f"{trigger} on {table}", (
+        pl_python_function,
+        f"{f.__name__}()",
+        trigger,
+        table,
+    )
+
+
+def _stored_hashes(cursor, functions):
+    """
+    Reads the hashes of the installed functions from the django_plpy_installed table. Functions or triggers
+    that don't exist in the database anymore, e.g. dropped together with their table, are left out
+    @param cursor: cursor to use
+    @param functions: dict of the keys of the functions and their objects as returned by _installed_object
+    @return: dict of the keys of the functions and the hashes of their installed code
+    """
+    keys, _, signatures, triggers, tables = zip(
+        *((key,) + objects for key, objects in functions.items())
+    )
+    cursor.execute(
+        "select i.signature, i.sha256 "
+        "from unnest(%s::text[], %s::text[], %s::text[], %s::text[]) as f(key, proc, trg, tbl) "
+        "join django_plpy_installed i on i.signature = f.key "
+        "where to_regprocedure(f.proc) is not null and (f.trg is null or exists ("
+        "select 1 from pg_trigger t where t.tgname = f.trg and t.tgrelid = to_regclass(f.tbl)))",
+        [list(keys), list(signatures), list(triggers), list(tables)],
+    )
+    return {key: bytes(digest) for key, digest in cursor.fetchall()}
+
+
+def _install(cursor, functions, force=False):
+    """
+    Installs the stored procedures in one round-trip, skipping the ones already installed with the same code.
+    The hashes of the installed functions are stored in the django_plpy_installed table and remembered by
+    the process once committed, so the table is only queried for the functions this process didn't install.
+    @param cursor: cursor to use
+    @param functions: dict of the keys of the functions and their objects as returned by _installed_object
+    @param force: install even if the same code is already installed
+    """
+    from django.db import connection, transaction
+
+    database = connection.settings_dict["NAME"]
+    digests = {key: _digest(objects[0]) for key, objects in functions.items()}
+    changed = [
+        key
+        for key, digest in digests.items()
+        if force or _installed_hashes.get((database, key)) != digest
+    ]
+    if changed and not force:
+        stored = _stored_hashes(cursor, {key: functions[key] for key in changed})
+        changed = [key for key in changed if stored.get(key) != digests[key]]
+
+    if changed:
+        # the code is sent along with the parameters of the hash update, % has to be escaped
+        sql = "\n".join(functions[key][0].replace("%", "%%") for key in changed)
+        values = ", ".join(["(%s, %s)"] * len(changed))
+        sql += (
+            f"\ninsert into django_plpy_installed (signature, sha256) values {values} "
+            "on conflict (signature) do update set sha256 = excluded.sha256;"
+        )
+        cursor.execute(sql, [x for key in changed for x in (key, digests[key])])
+
+    # remember the hashes only once the functions are committed, a rollback discards them
+    transaction.on_commit(
+        lambda: _installed_hashes.update(
+            {(database, key): digest for key, digest in digests.items()}
+        )
+    )
+
+
+def install_function(
+    f, trigger_params=None, function_params=None, cursor=None, force=False
+):
     """
     Installs function f as a trigger or stored procedure to the database. Must have a proper signature:
     - td, plpy for trigger without django ORM
@@ -18,43 +150,61 @@ def install_function(f, trigger_params=None, function_params=None, cursor=None):
     and plpy https://www.postgresql.org/docs/13/plpython-database.html objects
     @param f: function/callable to install as
     @param trigger_params: dict with params as accepted by build_pl_trigger_function
+    @param function_params: dict with params as accepted by build_pl_function
+    @param cursor: cursor to use, a new one is opened if not set
+    @param force: install even if the same code is already installed
     """
-    trigger_params = trigger_params or {}
-    function_params = function_params or {}
-    pl_python_function = (
-        build_pl_trigger_function(f, **trigger_params)
-        if trigger_params
-        else build_pl_function(f, **function_params)
-    )
+    from django.db import connection
+
+    functions = dict([_installed_object(f, trigger_params, function_params)])
     if not cursor:
         with connection.cursor() as cursor:
-            cursor.execute(pl_python_function)
+            _install(cursor, functions, force)
     else:
-        cursor.execute(pl_python_function)
+        _install(cursor, functions, force)
 
 
+# registered functions and their parameters, keyed by the module and qualified name of the function,
+# so a definition run again, e.g. a nested one, replaces the previous registration
 pl_functions = {}
 pl_triggers = {}
+# all the registered functions with the builders of their stored procedures, in the order of registration
+pl_registered = {}
+
+
+def _register(f, build, parameters, registry, decorator_name):
+    """
+    Registers the function for installation with manage.py syncfunctions
+    @param f: function/callable to register
+    @param build: builder of the stored procedure, build_pl_function or build_pl_trigger_function
+    @param parameters: params of the builder
+    @param registry: pl_functions or pl_triggers
+    @param decorator_name: name of the decorator to remove from the source
+    @return: registered function
+    """
+    # parse the source once at import time instead of on every install
+    try:
+        f._plpy_body = function_body(f, decorator_name)
+    except OSError:
+        pass
+
+    # the function itself is registered and returned, a wrapper would only add a call frame
+    key = (f.__module__, f.__qualname__)
+    registry[key] = (f, parameters)
+    pl_registered[key] = (f, build, parameters)
+    return f
 
 
 def plfunction(*args, **parameters):
     """
     Decorator marking a function for installation with manage.py syncfunctions as a stored procedure
-    @param parameters: parameters. global_ - makes the function available to other plpy functons over GD dict
-    @return: wrapped registered function
+    @param parameters: parameters. global_ - makes the function available to other plpy functons over GD dict,
+    jit - compiles the function with numba in the database interpreter, see build_pl_function
+    @return: registered function
     """
 
     def _plfunction(f):
-        @wraps(f)
-        def installed_func(*args, **kwargs):
-            return f(*args, **kwargs)
-
-        module = inspect.getmodule(installed_func)
-        pl_functions[f"{module.__name__}.{installed_func.__qualname__}"] = (
-            installed_func,
-            parameters,
-        )
-        return installed_func
+        return _register(f, build_pl_function, parameters, pl_functions, "plfunction")
 
     return _plfunction(args[0]) if args and callable(args[0]) else _plfunction
 
@@ -64,20 +214,18 @@ def pltrigger(**trigger_parameters):
     Decorator marking a function for installation with manage.py syncfunctions as a trigger function, see
     build_pl_trigger_function for parameters
     @param trigger_parameters: params of the trigger
-    @return: wrapped registered function
+    @return: registered function
     """
+    # the model doesn't change, resolve its names once instead of on every build
+    if "model" in trigger_parameters:
+        trigger_parameters["model_meta"] = resolve_model(
+            trigger_parameters.pop("model")
+        )
 
     def _pl_trigger(f):
-        @wraps(f)
-        def installed_func(*args, **kwargs):
-            return f(*args, **kwargs)
-
-        module = inspect.getmodule(installed_func)
-        pl_triggers[f"{module.__name__}.{installed_func.__qualname__}"] = (
-            installed_func,
-            trigger_parameters,
+        return _register(
+            f, build_pl_trigger_function, trigger_parameters, pl_triggers, "pltrigger"
         )
-        return installed_func
 
     return _pl_trigger
 
@@ -90,7 +238,8 @@ def pl_load_path(path: str):  # pragma: no cover
     """
     import sys
 
-    sys.path.append(path)
+    if path not in sys.path:
+        sys.path.append(path)
 
 
 # this code is only run in the database interpreter, that's why coverage doesn't see it
@@ -135,24 +284,41 @@ def pl_enable_orm(
     extra_env = extra_env or {}
     os.environ.update(**extra_env)
     for path in env_paths:
-        sys.path.append(path)
+        if path not in sys.path:
+            sys.path.append(path)
+
+    from django.apps import apps
+
+    # triggers call this function on every execution, django is set up once per session
+    if apps.ready:
+        return
 
     from django.core.wsgi import get_wsgi_application
 
     os.environ.setdefault("DJANGO_SETTINGS_MODULE", setting_module)
-    sys.path.append(project_path)
+    if project_path not in sys.path:
+        sys.path.append(project_path)
     get_wsgi_application()
 
 
-def sync_functions():
+def sync_functions(force=False):
     """
-    Installs functions decorated with @plfunction and @pltrigger to the database
+    Installs functions decorated with @plfunction and @pltrigger to the database in one round-trip and transaction.
+    Functions already installed are skipped if their code didn't change.
+    @param force: reinstall all the functions
     """
-    for function_name, f in pl_functions.items():
-        install_function(f[0], function_params=f[1])
-
-    for function_name, f in pl_triggers.items():
-        install_function(f[0], trigger_params=f[1])
+    from django.db import connection, transaction
+
+    # overloads with the same name are installed side by side, of several functions with the same signature,
+    # e.g. a redefined one, the last registered is installed
+    functions = dict(
+        _installed_object(f, params, None)
+        if build is build_pl_trigger_function
+        else _installed_object(f, None, params)
+        for f, build, params in pl_registered.values()
+    )
+    with transaction.atomic(), connection.cursor() as cursor:
+        _install(cursor, functions, force)
 
 
 @plfunction
@@ -166,13 +332,16 @@ def pl_python_version() -> str:  # pragma: no cover
     return python_version()
 
 
+@lru_cache(maxsize=1)
 def get_python_info():
     """
-    Return database python info as a dict
-    @return: dict with python information
+    Return database python info as a dict, the interpreter doesn't change during the lifetime of the process
+    @return: dict with python version and the version string of the postgres server
     """
-    install_function(pl_python_version)
+    from django.db import connection
+
     with connection.cursor() as cursor:
-        cursor.execute("select pl_python_version()")
-        info = {"version": cursor.fetchone()[0]}
-    return info
+        install_function(pl_python_version, cursor=cursor)
+        cursor.execute("select pl_python_version(), version()")
+        python_version, postgres_version = cursor.fetchone()
+    return {"version": python_version, "postgres_version": postgres_version}
@@ -22,6 +22,7 @@ class Command(BaseCommand):
         @param options: options of the command
         """
         info = get_python_info()
+        self.stdout.write(f"Database's Postgres version: {info['postgres_version']}")
         self.stdout.write(f"Database's Python version: {info['version']}")
 
         if sem_to_minor(info["version"]) != sem_to_minor(python_version()):
@@ -1,11 +1,7 @@
 from django.core.management.base import BaseCommand
 from django.db import transaction
 
-from django_plpy.installer import (
-    pl_functions,
-    pl_triggers,
-)
-from django_plpy.installer import sync_functions
+from django_plpy.installer import pl_functions, pl_triggers, sync_functions
 
 
 class Command(BaseCommand):
@@ -15,6 +11,17 @@ class Command(BaseCommand):
 
     help = "Syncs PL/Python functions, decorated with @plfunction and @pltrigger"
 
+    def add_arguments(self, parser):
+        """
+        Adds the command arguments
+        @param parser: argument parser of the command
+        """
+        parser.add_argument(
+            "--force",
+            action="store_true",
+            help="Reinstall all functions, even if they didn't change since the last sync",
+        )
+
     @transaction.atomic
     def handle(self, *args, **options):
         """
@@ -25,7 +32,7 @@ class Command(BaseCommand):
         if not pl_functions and not pl_triggers:
             self.stdout.write("No PL/Python functions found")
 
-        sync_functions()
+        sync_functions(force=options["force"])
         self.stdout.write(
             f"Synced {len(pl_functions)} functions and {len(pl_triggers)} triggers"
         )
@@ -0,0 +1,23 @@
+# Generated by Django 3.2.25 on 2026-10-15 10:12
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('django_plpy', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='InstalledFunction',
+            fields=[
+                ('name', models.CharField(max_length=63, primary_key=True, serialize=False)),
+                ('sha256', models.BinaryField(max_length=32)),
+            ],
+            options={
+                'db_table': 'django_plpy_installed',
+            },
+        ),
+    ]
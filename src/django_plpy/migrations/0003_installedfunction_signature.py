@@ -0,0 +1,23 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('django_plpy', '0002_installedfunction'),
+    ]
+
+    operations = [
+        # the hashes keyed by name can't tell the overloads apart, the functions are installed once again
+        migrations.RunSQL('delete from django_plpy_installed', migrations.RunSQL.noop),
+        migrations.RenameField(
+            model_name='installedfunction',
+            old_name='name',
+            new_name='signature',
+        ),
+        migrations.AlterField(
+            model_name='installedfunction',
+            name='signature',
+            field=models.TextField(primary_key=True, serialize=False),
+        ),
+    ]
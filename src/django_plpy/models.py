@@ -0,0 +1,14 @@
+from django.db.models import Model, TextField, BinaryField
+
+
+class InstalledFunction(Model):
+    """
+    Hash of the code of a function installed by django-plpy, unchanged functions are not installed again
+    """
+
+    # signature of the stored procedure, e.g. pl_max(integer,integer), or trigger and its table
+    signature = TextField(primary_key=True)
+    sha256 = BinaryField(max_length=32)
+
+    class Meta:
+        db_table = "django_plpy_installed"
@@ -1,12 +1,9 @@
-try:
-    from distutils.sysconfig import get_python_lib
-
-    default_env_paths = [get_python_lib()]
-except ImportError:
-    default_env_paths = []
+import sysconfig
 
 from django.conf import settings
 
+default_env_paths = [sysconfig.get_paths()["purelib"]]
+
 # python environment accessible for the database, within the docker container
 # if postgres runs within a docker container
 # defaults to the local python lib for the case of no containers when all runs
@@ -1,5 +1,27 @@
 __author__ = "Thorin Schiffer"
 
+import re
+
+
+def _decorator_pattern(name):
+    """
+    Compiles the pattern matching the decorator with the name up to the end of the decorators, including
+    arguments spanning multiple lines
+    @param name: name of the decorator
+    @return: compiled regular expression
+    """
+    return re.compile(rf"^[ \t]*@{re.escape(name)}\b.*", re.MULTILINE | re.DOTALL)
+
+
+# the decorators are only looked for before the def statement, not in the body
+_def_pattern = re.compile(r"^[ \t]*(?:async[ \t]+)?def\b", re.MULTILINE)
+
+
+_decorator_patterns = {
+    "plfunction": _decorator_pattern("plfunction"),
+    "pltrigger": _decorator_pattern("pltrigger"),
+}
+
 
 def remove_decorator(source_code, name):
     """
@@ -9,11 +31,12 @@ def remove_decorator(source_code, name):
     @param name: name of the decorator to remove
     @return: source code of the function without the decorator statement
     """
-    start = source_code.find(f"@{name}")
-    end = source_code.find("def")
-    if start < 0:
-        return source_code
-    return source_code[:start] + source_code[end:]
+    pattern = _decorator_patterns.get(name)
+    if pattern is None:
+        pattern = _decorator_patterns[name] = _decorator_pattern(name)
+    match = _def_pattern.search(source_code)
+    end = match.start() if match else 0
+    return pattern.sub("", source_code[:end], count=1) + source_code[end:]
 
 
 def sem_to_minor(version):
@@ -22,4 +45,6 @@ def sem_to_minor(version):
     @param version: semantic version in format x.x.x
     @return: minor release in format x.x
     """
-    return ".".join(version.split(".")[:2])
+    # cut at the second dot instead of splitting all the parts
+    end = version.find(".", version.find(".") + 1)
+    return version if end < 0 else version[:end]
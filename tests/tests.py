@@ -1,24 +1,32 @@
+import importlib
+import json
 import os
+import sys
 from platform import python_version
-from typing import List
+from typing import Dict, List
 
 from django.core.management import call_command
 from django.db import connection
 from django.db.models import Func, F, Transform
 from django.db.models import IntegerField
+from django.test.utils import CaptureQueriesContext
 from django_plpy.builder import (
     build_pl_function,
     build_pl_trigger_function,
+    type_mapper,
 )
 from django_plpy.installer import (
     install_function,
     plfunction,
     pltrigger,
     get_python_info,
+    forget_installed_functions,
     pl_triggers,
     pl_functions,
+    sync_functions,
 )
-from django_plpy.utils import sem_to_minor
+from django_plpy.models import InstalledFunction
+from django_plpy.utils import sem_to_minor, remove_decorator
 from pytest import fixture, mark, skip, raises
 
 from tests.books.models import Book
@@ -110,7 +118,7 @@ def test_plfunction_decorator_registers():
             return a
         return b
 
-    assert pl_max, {} in pl_functions.values()
+    assert pl_functions[(pl_max.__module__, pl_max.__qualname__)] == (pl_max, {})
 
 
 def test_generate_trigger_function(db):
@@ -137,16 +145,29 @@ def test_generate_trigger_function(db):
         )
 
 
+def test_plfunction_decorator_replaces_redefined():
+    def register():
+        @plfunction
+        def pl_test_redefined(a: int) -> int:
+            return a
+
+        return pl_test_redefined
+
+    count = len(pl_functions)
+    register()
+    pl_test_redefined = register()
+    assert len(pl_functions) == count + 1
+    key = (pl_test_redefined.__module__, pl_test_redefined.__qualname__)
+    assert pl_functions[key][0] is pl_test_redefined
+
+
 def test_pltrigger_decorator_registers():
     @pltrigger(event="INSERT", when="BEFORE", table="books_book")
     def pl_trigger_test_decorator_registers(td, plpy):
         pass
 
-    f, params = next(
-        x
-        for x in list(pl_triggers.values())
-        if x[0].__name__ == "pl_trigger_test_decorator_registers"
-    )
+    f = pl_trigger_test_decorator_registers
+    f, params = pl_triggers[(f.__module__, f.__qualname__)]
     assert params["event"] == "INSERT"
     assert params["when"] == "BEFORE"
     assert params["table"] == "books_book"
@@ -184,6 +205,96 @@ def test_function_different_arguments(db):
         cursor.callproc("pl_test_arguments", [["a", "b"], [1, 2], True, 1.5])
 
 
+@mark.skipif(sys.version_info < (3, 9), reason="PEP 585 generics need python 3.9")
+def test_function_builtin_generic_arguments(db):
+    # the annotations are evaluated by the database interpreter as well
+    db_version = get_python_info()["version"].split(".")
+    if (int(db_version[0]), int(db_version[1])) < (3, 9):
+        skip("PEP 585 generics need python 3.9 in the database")
+
+    def pl_test_builtin_generics(
+        list_str: list[str], list_int: list[int], env: dict[str, str]
+    ) -> int:
+        return len(list_str) + len(list_int) + len(env)
+
+    install_function(pl_test_builtin_generics)
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "select pl_test_builtin_generics(%s, %s, %s)",
+            [["a", "b"], [1, 2], '{"a": "b"}'],
+        )
+        assert cursor.fetchone()[0] == 5
+
+
+def test_function_jsonb_argument_body_uses_json(db):
+    def pl_test_jsonb_dumps(env: Dict[str, str]) -> str:
+        return json.dumps(env, sort_keys=True)
+
+    install_function(pl_test_jsonb_dumps)
+    with connection.cursor() as cursor:
+        cursor.execute("select pl_test_jsonb_dumps(%s)", ['{"b": "2", "a": "1"}'])
+        assert cursor.fetchone()[0] == '{"a": "1", "b": "2"}'
+
+
+def test_function_scalar_arguments_body_uses_json(db):
+    # json and typing stay available to the body even if the signature doesn't need them
+    def pl_test_str_dumps(a: str) -> str:
+        return json.dumps([a])
+
+    install_function(pl_test_str_dumps)
+    with connection.cursor() as cursor:
+        cursor.execute("select pl_test_str_dumps(%s)", ["a"])
+        assert cursor.fetchone()[0] == '["a"]'
+
+
+def test_function_jit(db):
+    def pl_test_jit(a: int, b: int) -> int:
+        return a * b
+
+    # falls back to the plain function if numba isn't installed in the database
+    install_function(pl_test_jit, function_params={"jit": True})
+    with connection.cursor() as cursor:
+        cursor.execute("select pl_test_jit(6, 7), pl_test_jit(2, 3)")
+        assert cursor.fetchone() == (42, 6)
+
+
+def test_function_global(db):
+    def pl_test_global(a: int) -> int:
+        return a + 1
+
+    def pl_test_global_call(a: int) -> int:
+        return GD["pl_test_global"](a)  # noqa: F821
+
+    install_function(pl_test_global, function_params={"global_": True})
+    install_function(pl_test_global_call)
+    with connection.cursor() as cursor:
+        cursor.execute("select pl_test_global(1)")
+        cursor.execute("select pl_test_global_call(41)")
+        assert cursor.fetchone()[0] == 42
+
+
+def test_function_reloaded_module(tmp_path, monkeypatch):
+    module_path = tmp_path / "pl_reloaded.py"
+    module_path.write_text("def pl_reloaded(a: int) -> int:\n    return a + 1\n")
+    monkeypatch.syspath_prepend(str(tmp_path))
+    module = importlib.import_module("pl_reloaded")
+    assert "return a + 1\\n" in build_pl_function(module.pl_reloaded)
+
+    module_path.write_text("def pl_reloaded(a: int) -> int:\n    return a + 10\n")
+    module = importlib.reload(module)
+    assert "return a + 10\\n" in build_pl_function(module.pl_reloaded)
+
+
+def test_function_type_mapper_override(monkeypatch):
+    def pl_test_override(a: str) -> str:
+        return a
+
+    monkeypatch.setitem(type_mapper, str, "text")
+    assert "pl_test_override (a text) RETURNS text" in build_pl_function(
+        pl_test_override
+    )
+
+
 def test_function_unknown_type(db):
     def pl_test_arguments(arg: Book) -> int:
         return 1
@@ -215,6 +326,144 @@ def test_sync_functions():
     assert row[0] == 20
 
 
+def function_installed(name):
+    with connection.cursor() as cursor:
+        cursor.execute("select count(*) from pg_proc where proname = %s", [name])
+        return cursor.fetchone()[0] == 1
+
+
+def trigger_installed(name):
+    with connection.cursor() as cursor:
+        cursor.execute("select count(*) from pg_trigger where tgname = %s", [name])
+        return cursor.fetchone()[0] == 1
+
+
+def synced_sql():
+    # the process remembers the installed functions, forget them to check the database
+    forget_installed_functions()
+    with CaptureQueriesContext(connection) as queries:
+        call_command("syncfunctions")
+    return "".join(q["sql"] for q in queries)
+
+
+@mark.django_db(transaction=True)
+def test_sync_functions_skips_unchanged():
+    @plfunction
+    def pl_test_sync_unchanged(a: int) -> int:
+        return a
+
+    call_command("syncfunctions")
+    assert InstalledFunction.objects.filter(
+        signature="pl_test_sync_unchanged(integer)"
+    ).exists()
+    assert "FUNCTION pl_test_sync_unchanged" not in synced_sql()
+
+    with connection.cursor() as cursor:
+        cursor.execute("DROP FUNCTION pl_test_sync_unchanged;")
+    assert "FUNCTION pl_test_sync_unchanged" in synced_sql()
+    assert function_installed("pl_test_sync_unchanged")
+
+
+def register_overload_int():
+    @plfunction
+    def pl_test_overload(a: int) -> str:
+        return "int"
+
+
+def register_overload_str():
+    @plfunction
+    def pl_test_overload(a: str) -> str:
+        return "str"
+
+
+@mark.django_db(transaction=True)
+def test_sync_functions_overloads():
+    register_overload_int()
+    register_overload_str()
+    call_command("syncfunctions")
+    with connection.cursor() as cursor:
+        cursor.execute("select pl_test_overload(1), pl_test_overload('a'::varchar)")
+        assert cursor.fetchone() == ("int", "str")
+    assert (
+        InstalledFunction.objects.filter(
+            signature__in=["pl_test_overload(integer)", "pl_test_overload(varchar)"]
+        ).count()
+        == 2
+    )
+
+
+@mark.django_db(transaction=True)
+def test_sync_functions_reinstalls_dropped_trigger():
+    @pltrigger(event="INSERT", when="BEFORE", table="books_book")
+    def pl_test_sync_dropped(td, plpy):
+        pass
+
+    call_command("syncfunctions")
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "DROP TRIGGER pl_test_sync_dropped_trigger ON books_book CASCADE;"
+        )
+    assert "FUNCTION pl_test_sync_dropped" in synced_sql()
+    assert trigger_installed("pl_test_sync_dropped_trigger")
+
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "DROP TRIGGER pl_test_sync_dropped_trigger ON books_book CASCADE;"
+        )
+
+
+@mark.django_db(transaction=True)
+def test_sync_functions_single_round_trip():
+    with CaptureQueriesContext(connection) as queries:
+        sync_functions(force=True)
+    # all the functions and the hash update are sent in one statement batch
+    assert len([q for q in queries if "CREATE OR REPLACE" in q["sql"]]) == 1
+
+
 @mark.django_db(transaction=True)
 def test_check_env():
     call_command("checkenv")
+
+
+def test_remove_decorator_multiline():
+    source = """@pltrigger(
+    event="INSERT",
+    when="BEFORE",
+    table="books_book",
+)
+def pl_trigger(td, plpy):
+    \"\"\"
+    @pltrigger in the docstring is kept
+    \"\"\"
+"""
+    assert remove_decorator(source, "pltrigger") == source[source.find("def") :]
+
+
+def test_remove_decorator_undecorated():
+    source = """def pl_function():
+    \"\"\"
+    @plfunction in the docstring is kept
+    \"\"\"
+
+    def nested():
+        pass
+"""
+    assert remove_decorator(source, "plfunction") == source
+
+
+def test_remove_decorator_dotted_name():
+    source = """@django_plpy.installer.plfunction
+def pl_max(a: int, b: int) -> int:
+    return max(a, b)
+"""
+    assert (
+        remove_decorator(source, "django_plpy.installer.plfunction")
+        == source[source.find("def") :]
+    )
+    # the dots are matched literally
+    assert remove_decorator(source, "django_plpy_installer_plfunction") == source
+
+
+def test_sem_to_minor():
+    assert sem_to_minor("3.11.4") == "3.11"
+    assert sem_to_minor("3.11") == "3.11"